@@ -323,13 +323,16 @@ def get_custom_spec(classes: list, device_class):
 
 
 def get_spec_wrapper(func, sensors: list):
+    # same sensor class for all devices
+    sensor_classes = {uid: spec(XSensor, param=uid) for uid in sensors}
+
     def wrapped(device: dict) -> list:
         classes = func(device)
         for uid in sensors:
             if (uid in device["params"] or uid == "host") and all(
                     cls.param != uid and cls.uid != uid for cls in classes
             ):
-                classes.append(spec(XSensor, param=uid))
+                classes.append(sensor_classes[uid])
         return classes
 
     return wrapped
@@ -4,7 +4,7 @@ from homeassistant.helpers.device_registry import CONNECTION_NETWORK_MAC
 from homeassistant.helpers.entity import DeviceInfo, Entity, EntityCategory
 
 from .const import DOMAIN
-from .ewelink import XRegistry, XDevice
+from .ewelink import XRegistry, XDevice, SIGNAL_CLOUD_CONNECTED
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -88,6 +88,9 @@ class XEntity(Entity):
         except Exception as e:
             _LOGGER.error(f"Can't init device: {device}", exc_info=e)
         ewelink.dispatcher_connect(deviceid, self.internal_update)
+        ewelink.dispatcher_connect(
+            SIGNAL_CLOUD_CONNECTED, self.internal_update
+        )
 
     def set_state(self, params: dict):
         pass
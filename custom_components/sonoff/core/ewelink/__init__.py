@@ -1,7 +1,9 @@
 import asyncio
+import contextvars
 import logging
+import sys
 import time
-from typing import Dict, List
+from typing import Coroutine, Dict, List, Optional, Set, Tuple
 
 from aiohttp import ClientSession
 
@@ -12,6 +14,16 @@ from .local import XRegistryLocal, decrypt
 _LOGGER = logging.getLogger(__name__)
 
 SIGNAL_ADD_ENTITIES = "add_entities"
+SIGNAL_CLOUD_CONNECTED = "cloud_connected"
+
+
+def create_task(coro: Coroutine) -> asyncio.Task:
+    """Background tasks don't need caller context vars, so skip copying them
+    (Python 3.11+).
+    """
+    if sys.version_info >= (3, 11):
+        return asyncio.create_task(coro, context=contextvars.Context())
+    return asyncio.create_task(coro)
 
 
 class XRegistry(XRegistryBase):
@@ -19,9 +31,22 @@ class XRegistry(XRegistryBase):
     task: asyncio.Task = None
 
     def __init__(self, session: ClientSession):
+        """Session is shared between Cloud and Local registries, so it should
+        be a long-lived session with a connection pool (ex. Hass shared
+        session from `async_get_clientsession`). Creating session per request
+        will lose TCP and TLS state for each Cloud command.
+        """
         super().__init__(session)
 
         self.devices: Dict[str, XDevice] = {}
+        # pow devices with uiActive params: [(device, dt, params)]
+        self.pow_devices: List[Tuple[XDevice, int, dict]] = []
+        # params waiting for send: {deviceid: (params, future, query_cloud)}
+        self._pending: Dict[str, Tuple[dict, asyncio.Future, bool]] = {}
+        # hold background tasks, so they won't be destroyed before finish
+        self._tasks: Set[asyncio.Task] = set()
+        # limit concurrent Cloud commands, so they won't flood the connection
+        self._cloud_sem = asyncio.Semaphore(16)
 
         self.cloud = XRegistryCloud(session)
         self.cloud.dispatcher_connect(SIGNAL_CONNECTED, self.cloud_connected)
@@ -31,7 +56,7 @@ class XRegistry(XRegistryBase):
         self.local.dispatcher_connect(SIGNAL_UPDATE, self.local_update)
 
     def setup_devices(self, devices: List[XDevice]) -> list:
-        from ..devices import get_spec
+        from ..devices import get_spec, POW_UI_ACTIVE
 
         entities = []
 
@@ -46,7 +71,7 @@ class XRegistry(XRegistryBase):
 
             try:
                 uiid = device['extra']['uiid']
-                _LOGGER.debug(f"{did} UIID {uiid:04} | %s", device["params"])
+                _LOGGER.debug("%s UIID %04d | %s", did, uiid, device["params"])
 
                 # at this moment entities can catch signals with device_id and
                 # update their states, but they can be added to hass later
@@ -54,17 +79,30 @@ class XRegistry(XRegistryBase):
 
                 self.devices[did] = device
 
+                if uiid in POW_UI_ACTIVE:
+                    self.pow_devices.append((device, *POW_UI_ACTIVE[uiid]))
+
             except Exception as e:
                 _LOGGER.warning(f"{did} !! can't setup device", exc_info=e)
 
+        # pow device may be added after cloud connected
+        self.start_pow_helper()
+
         return entities
 
     @property
     def online(self) -> bool:
         return self.cloud.online is not None or self.local.online
 
+    def create_task(self, coro: Coroutine) -> asyncio.Task:
+        task = create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
     async def stop(self, *args):
         self.devices.clear()
+        self.pow_devices.clear()
         self.dispatcher.clear()
 
         await self.cloud.stop()
@@ -79,6 +117,61 @@ class XRegistry(XRegistryBase):
     ):
         """Send command to device with LAN and Cloud. Usual params are same.
 
+        Concurrent state updates for the same device are merged into one
+        command if they don't change the same params and have the same
+        query_cloud. Other commands for the device wait until pending updates
+        are sent, so they never overtake them.
+        """
+        did = device["deviceid"]
+
+        # DIY devices use first param as LAN command, so they can't be merged
+        can_merge = params and not params_lan and "cmd" not in params and \
+            not (device.get("host") and "devicekey" not in device)
+
+        while did in self._pending:
+            pending, fut, query = self._pending[did]
+            if can_merge and query == query_cloud and \
+                    pending.keys().isdisjoint(params):
+                pending.update(params)
+                # shield, so cancelled waiter won't cancel other waiters
+                return await asyncio.shield(fut)
+            # wait without raising errors and without cancelling the future
+            await asyncio.wait([fut])
+
+        if not can_merge:
+            return await self._send(device, params, params_lan, query_cloud)
+
+        fut = asyncio.get_event_loop().create_future()
+        self._pending[did] = (dict(params), fut, query_cloud)
+        # registry task, so cancelled caller won't cancel merged updates
+        self.create_task(self._send_pending(device, fut))
+        # shield, so cancelled caller won't cancel other callers
+        return await asyncio.shield(fut)
+
+    async def _send_pending(self, device: XDevice, fut: asyncio.Future):
+        did = device["deviceid"]
+        try:
+            # wait for other updates for the same device
+            await asyncio.sleep(0.02)
+            params, _, query_cloud = self._pending.pop(did)
+            fut.set_result(await self._send(device, params, None, query_cloud))
+        except asyncio.CancelledError:
+            # registry stopped while waiting for other updates
+            if did in self._pending and self._pending[did][1] is fut:
+                self._pending.pop(did)
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # mark as retrieved, callers may be cancelled already
+            fut.exception()
+
+    async def _send(
+            self, device: XDevice, params: dict = None,
+            params_lan: dict = None, query_cloud: bool = True
+    ):
+        """Send command to device with LAN and Cloud. Usual params are same.
+
         LAN will send new device state after update command, Cloud - don't.
 
         :param device: device object
@@ -93,27 +186,24 @@ class XRegistry(XRegistryBase):
         can_cloud = self.cloud.online and device.get('online')
 
         if can_local and can_cloud:
-            # try to send a command locally (wait no more than a second)
-            ok = await self.local.send(device, params_lan or params, seq, 1)
-
-            # otherwise send a command through the cloud
+            ok, from_cloud = await self.send_both(
+                device, params, params_lan, seq
+            )
             if ok != 'online':
-                ok = await self.cloud.send(device, params, seq)
-                if ok != 'online':
-                    asyncio.create_task(self.check_offline(device))
-                elif query_cloud and params:
-                    # force update device actual status
-                    await self.cloud.send(device, timeout=0)
+                self.create_task(self.check_offline(device))
+            elif from_cloud and query_cloud and params:
+                # force update device actual status
+                await self.cloud_send(device, timeout=0)
 
         elif can_local:
             ok = await self.local.send(device, params_lan or params, seq, 5)
             if ok != 'online':
-                asyncio.create_task(self.check_offline(device))
+                self.create_task(self.check_offline(device))
 
         elif can_cloud:
-            ok = await self.cloud.send(device, params, seq)
+            ok = await self.cloud_send(device, params, seq)
             if ok == "online" and query_cloud and params:
-                await self.cloud.send(device, timeout=0)
+                await self.cloud_send(device, timeout=0)
 
         else:
             return
@@ -121,6 +211,78 @@ class XRegistry(XRegistryBase):
         # TODO: response state
         # self.dispatcher_send(device["deviceid"], state)
 
+    async def send_both(
+            self, device: XDevice, params: dict, params_lan: dict, seq: str
+    ) -> Tuple[str, bool]:
+        """Send command with LAN and start Cloud only if LAN doesn't respond
+        in a second (or fails). Return first success result and True if it
+        came from the Cloud.
+
+        Commands with `cmd` (ex. RF transmit) shouldn't be executed twice, so
+        they are sent to the Cloud only if LAN fails.
+        """
+        if params and "cmd" in params:
+            # try to send a command locally (wait no more than a second)
+            ok = await self.local.send(device, params_lan or params, seq, 1)
+            if ok == 'online':
+                return ok, False
+
+            # otherwise send a command through the cloud
+            return await self.cloud_send(device, params, seq), True
+
+        local = asyncio.create_task(
+            self.local.send(device, params_lan or params, seq, 5)
+        )
+        pending = {local}
+        cloud = None
+        ok = None
+
+        try:
+            # usually LAN responds fast, so the Cloud isn't needed
+            done, pending = await asyncio.wait(pending, timeout=1)
+            if done:
+                ok = local.result()
+                if ok == 'online':
+                    return ok, False
+
+            # LAN is slow or failed, but it can still respond
+            cloud = asyncio.create_task(self.cloud_send(device, params, seq))
+            pending.add(cloud)
+
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    ok = task.result()
+                    if ok == 'online':
+                        return ok, task is cloud
+        finally:
+            # stop waiting response from the other request
+            for task in pending:
+                task.cancel()
+
+        return ok, False
+
+    async def cloud_send(
+            self, device: XDevice, params: dict = None, sequence: str = None,
+            timeout: int = 5
+    ) -> Optional[str]:
+        """Send command to Cloud and retry transport errors two times. Device
+        offline, API errors and timeout are returned as is. Timeout is not
+        repeated, because the device may have already received command.
+        With zero timeout - won't wait response and won't retry.
+        """
+        for delay in (0.2, 0.4, None):
+            async with self._cloud_sem:
+                ok = await self.cloud.send(device, params, sequence, timeout)
+            if not timeout or ok != 'E#???' or not delay or \
+                    not self.cloud.online:
+                return ok
+            await asyncio.sleep(delay)
+            # new sequence for each retry
+            sequence = None
+
     async def send_bulk(self, device: XDevice, params: dict):
         assert "switches" in params
 
@@ -155,11 +317,16 @@ class XRegistry(XRegistryBase):
         self.dispatcher_send(did)
 
     def cloud_connected(self):
-        for deviceid in self.devices.keys():
-            self.dispatcher_send(deviceid)
+        # one signal for all entities instead of signal for each device
+        self.dispatcher_send(SIGNAL_CLOUD_CONNECTED)
+
+        self.start_pow_helper()
 
-        if self.cloud.online and (not self.task or self.task.done()):
-            self.task = asyncio.create_task(self.pow_helper())
+    def start_pow_helper(self):
+        if self.pow_devices and self.cloud.online and (
+                not self.task or self.task.done()
+        ):
+            self.task = create_task(self.pow_helper())
 
     def cloud_update(self, msg: dict):
         did = msg["deviceid"]
@@ -169,15 +336,18 @@ class XRegistry(XRegistryBase):
             return
 
         params = msg["params"]
+        online = params.get("online")
 
-        _LOGGER.debug(f"{did} <= Cloud3 | %s | {msg.get('sequence')}", params)
+        _LOGGER.debug(
+            "%s <= Cloud3 | %s | %s", did, params, msg.get("sequence")
+        )
 
         # process online change
-        if "online" in params:
-            device["online"] = params["online"]
+        if online is not None:
+            device["online"] = online
             # check if LAN online after cloud offline
-            if not device["online"] and device.get("host"):
-                asyncio.create_task(self.check_offline(device))
+            if not online and device.get("host"):
+                self.create_task(self.check_offline(device))
 
         elif device["online"] is False:
             device["online"] = True
@@ -208,10 +378,11 @@ class XRegistry(XRegistryBase):
             self.dispatcher_send(SIGNAL_ADD_ENTITIES, entities)
 
         elif not params:
-            if "devicekey" not in device:
+            devicekey = device.get("devicekey")
+            if not devicekey:
                 return
             try:
-                params = self.local.decrypt_msg(msg, device["devicekey"])
+                params = self.local.decrypt_msg(msg, devicekey)
             except Exception as e:
                 _LOGGER.debug("Can't decrypt message", exc_info=e)
                 return
@@ -223,11 +394,13 @@ class XRegistry(XRegistryBase):
 
         tag = "Local3" if "host" in msg else "Local0"
 
-        _LOGGER.debug(f"{did} <= {tag} | %s | {msg.get('seq', '')}", params)
+        _LOGGER.debug(
+            "%s <= %s | %s | %s", did, tag, params, msg.get("seq", "")
+        )
 
         # msg from zeroconf ServiceStateChange.Removed
         if params.get("online") is False:
-            asyncio.create_task(self.check_offline(device))
+            self.create_task(self.check_offline(device))
             return
 
         if "sledOnline" in params:
@@ -242,16 +415,6 @@ class XRegistry(XRegistryBase):
         self.dispatcher_send(did, params)
 
     async def pow_helper(self):
-        from ..devices import POW_UI_ACTIVE
-
-        # collect pow devices
-        devices = [
-            device for device in self.devices.values()
-            if "extra" in device and device["extra"]["uiid"] in POW_UI_ACTIVE
-        ]
-        if not devices:
-            return
-
         while True:
             if not self.cloud.online:
                 await asyncio.sleep(60)
@@ -259,13 +422,20 @@ class XRegistry(XRegistryBase):
 
             ts = time.time()
 
-            for device in devices:
+            for device, dt, params in self.pow_devices:
                 if not device.get("online") or device.get("pow_ts", 0) > ts:
                     continue
 
-                dt, params = POW_UI_ACTIVE[device["extra"]["uiid"]]
+                # update ts before send, so slow response won't repeat command
                 device["pow_ts"] = ts + dt
-                await self.cloud.send(device, params, timeout=0)
+                # one by one, so user commands won't wait for all of them
+                await self.cloud_send(device, params, timeout=0)
 
-            # sleep for 150 seconds (because minimal uiActive - 180 seconds)
-            await asyncio.sleep(150)
+            # sleep until the nearest pow_ts, but no more than 150 seconds
+            # (because minimal uiActive - 180 seconds)
+            ts = time.time()
+            delay = min([
+                device["pow_ts"] - ts for device, _, _ in self.pow_devices
+                if device.get("pow_ts", 0) > ts
+            ], default=150)
+            await asyncio.sleep(max(1, min(150, delay)))
@@ -1,6 +1,6 @@
 import asyncio
 import time
-from typing import Callable, Dict, List, Optional, TypedDict
+from typing import Callable, Dict, Optional, TypedDict
 
 from aiohttp import ClientSession
 
@@ -29,7 +29,8 @@ class XDevice(TypedDict, total=False):
 
 
 class XRegistryBase:
-    dispatcher: Dict[str, List[Callable]] = None
+    # {signal: {target: None}}, dict works as ordered set for targets
+    dispatcher: Dict[str, Dict[Callable, None]] = None
     _sequence: int = 0
 
     def __init__(self, session: ClientSession):
@@ -47,15 +48,16 @@ class XRegistryBase:
         return str(XRegistryBase._sequence)
 
     def dispatcher_connect(self, signal: str, target: Callable) -> Callable:
-        targets = self.dispatcher.setdefault(signal, [])
-        if target not in targets:
-            targets.append(target)
-        return lambda: targets.remove(target)
+        targets = self.dispatcher.setdefault(signal, {})
+        targets[target] = None
+        return lambda: targets.pop(target, None)
 
     def dispatcher_send(self, signal: str, *args, **kwargs):
-        if not self.dispatcher.get(signal):
+        targets = self.dispatcher.get(signal)
+        if not targets:
             return
-        for handler in self.dispatcher[signal]:
+        # handler may connect or disconnect other handlers
+        for handler in tuple(targets):
             handler(*args, **kwargs)
 
     async def dispatcher_wait(self, signal: str):
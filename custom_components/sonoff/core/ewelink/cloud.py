@@ -56,27 +56,31 @@ class ResponseWaiter:
     _waiters = {}
 
     def _set_response(self, sequence: str, error: int) -> bool:
-        if sequence not in self._waiters:
+        fut = self._waiters.get(sequence)
+        # waiter may be already cancelled
+        if fut is None or fut.done():
             return False
         # sometimes the error doesn't exists
         result = DATA_ERROR[error] if error in DATA_ERROR else f"E#{error}"
-        self._waiters[sequence].set_result(result)
+        fut.set_result(result)
         return True
 
     async def _wait_response(self, sequence: str, timeout: int):
-        self._waiters[sequence] = asyncio.get_event_loop().create_future()
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters[sequence] = fut
 
         try:
             # limit future wait time
-            await asyncio.wait_for(self._waiters[sequence], timeout)
+            await asyncio.wait_for(fut, timeout)
         except asyncio.TimeoutError:
-            # remove future from waiters, in very rare cases, we can send two
-            # commands with the same sequence
-            self._waiters.pop(sequence, None)
             return 'timeout'
+        finally:
+            # remove future from waiters (also on cancel), in very rare cases,
+            # we can send two commands with the same sequence
+            if self._waiters.get(sequence) is fut:
+                self._waiters.pop(sequence)
 
-        # remove future from waiters and return result
-        return self._waiters.pop(sequence).result()
+        return fut.result()
 
 
 class XRegistryCloud(ResponseWaiter, XRegistryBase):
@@ -149,7 +149,7 @@ class XServiceBrowser(AsyncServiceBrowser):
                 if not key.endswith(self.suffix):
                     continue
 
-                for record in records.keys():
+                for record in records:
                     if not isinstance(record, DNSText) or \
                             record.is_expired(now):
                         continue
@@ -158,10 +158,10 @@ class XServiceBrowser(AsyncServiceBrowser):
 
                     key = record.key[:18] + ".local."
                     if key in cache:
-                        for r in cache[key].keys():
+                        for r in cache[key]:
                             if isinstance(r, DNSAddress):
                                 host = str(ipaddress.ip_address(r.address))
-                        for r in records.keys():
+                        for r in records:
                             if isinstance(r, DNSService):
                                 host += f":{r.port}"
 
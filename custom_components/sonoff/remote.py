@@ -42,8 +42,9 @@ def rfbridge_childs(remotes: list, config: dict = None):
                 child = {"name": remote["name"]}
 
             # everride child params from YAML
-            if config and child["name"] in config:
-                child.update(config[child["name"]])
+            overrides = config and config.get(child["name"])
+            if overrides:
+                child.update(overrides)
 
                 if "payload_off" in child:
                     duals[channel] = child["payload_off"]
@@ -57,14 +58,14 @@ def rfbridge_childs(remotes: list, config: dict = None):
             child["channel"] = channel
             childs[channel] = child
 
+    # reversed, so the first child wins for duplicate names
+    name_to_ch = {v["name"]: k for k, v in reversed(childs.items())}
+
     for ch, name in duals.items():
-        try:
-            ch_off = next(k for k, v in childs.items() if v["name"] == name)
-        except StopIteration:
+        ch_off = name_to_ch.get(name)
+        if ch_off is None:
             _LOGGER.warning("Can't find payload_off: " + name)
             continue
-        # move off channel to end of the dict
-        childs[ch_off] = childs.pop(ch_off)
         childs[ch_off]["channel_on"] = ch
 
     return childs
@@ -76,6 +77,7 @@ class XRemote(XEntity, RemoteEntity):
     childs: Dict[
         str, Union[XRemoteButton, XRemoteSensor, XRemoteSensorOff]
     ] = None
+    _name_to_channel: Dict[str, str] = None
 
     def __init__(self, ewelink: XRegistry, device: dict):
         try:
@@ -84,7 +86,10 @@ class XRemote(XEntity, RemoteEntity):
 
             config = ewelink.config and ewelink.config.get("rfbridge")
             childs = rfbridge_childs(device["tags"]["zyx_info"], config)
-            for ch, child in list(childs.items()):
+            # process off channels after their on channels
+            for ch, child in sorted(
+                    childs.items(), key=lambda kv: "channel_on" in kv[1]
+            ):
                 if ch not in channels:
                     childs.pop(ch)
                     continue
@@ -98,6 +103,9 @@ class XRemote(XEntity, RemoteEntity):
                     childs[ch] = XRemoteSensor(ewelink, device, child)
             ewelink.dispatcher_send(SIGNAL_ADD_ENTITIES, childs.values())
             self.childs = childs
+            self._name_to_channel = {
+                c.name: k for k, c in reversed(childs.items())
+            }
 
         except Exception as e:
             _LOGGER.error(
@@ -162,9 +170,10 @@ class XRemote(XEntity, RemoteEntity):
 
             # transform button name to channel number
             if not channel.isdigit():
-                channel = next(
-                    k for k, v in self.childs.items() if v.name == channel
-                )
+                if channel not in self._name_to_channel:
+                    _LOGGER.warning(f"Can't find button: {channel}")
+                    continue
+                channel = self._name_to_channel[channel]
 
             # cmd param for local and for cloud mode
             await self.ewelink.send(self.device, {
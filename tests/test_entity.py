@@ -45,7 +45,7 @@ def get_entitites(device: dict, config: dict = None) -> list:
 
     entities = []
 
-    asyncio.create_task = lambda _: None
+    asyncio.create_task = lambda *args, **kwargs: None
 
     reg = DummyRegistry()
     reg.cloud.online = True
@@ -4,6 +4,9 @@ from custom_components.sonoff.core.ewelink import XRegistry, XDevice
 
 from . import save_to
 
+# test_entity replaces asyncio.create_task with a stub
+create_task = asyncio.create_task
+
 
 def test_bulk():
     registry_send = []
@@ -36,3 +39,173 @@ def test_bulk():
     assert registry_send[0][1] == {"switches": [
         {"outlet": 1, "switch": "on"}, {"outlet": 2, "switch": "off"}
     ]}
+
+
+def test_cloud_send():
+    results = []
+    sequences = []
+
+    async def send(device, params, sequence, timeout):
+        sequences.append(sequence)
+        return results.pop(0)
+
+    device = XDevice(deviceid="1000123abc")
+    loop = asyncio.get_event_loop()
+    # noinspection PyTypeChecker
+    registry: XRegistry = XRegistry(None)
+    registry.cloud.online = True
+    registry.cloud.send = send
+
+    # transport error retried with new sequence
+    results[:] = ["E#???", "E#???", "online"]
+    ok = loop.run_until_complete(registry.cloud_send(device, {}, "1"))
+    assert ok == "online"
+    assert sequences == ["1", None, None]
+
+    # no more than three tries
+    sequences.clear()
+    results[:] = ["E#???", "E#???", "E#???"]
+    ok = loop.run_until_complete(registry.cloud_send(device, {}, "1"))
+    assert ok == "E#???"
+    assert len(sequences) == 3
+
+    # device offline, API errors and timeout are not retried
+    for result in ("offline", "E#400", "timeout"):
+        sequences.clear()
+        results[:] = [result]
+        ok = loop.run_until_complete(registry.cloud_send(device, {}, "1"))
+        assert ok == result
+        assert len(sequences) == 1
+
+    # zero timeout - no response and no retries
+    sequences.clear()
+    results[:] = [None]
+    ok = loop.run_until_complete(registry.cloud_send(device, timeout=0))
+    assert ok is None
+    assert len(sequences) == 1
+
+
+def test_send_merge():
+    registry_send = []
+
+    async def send(*args):
+        registry_send.append(args)
+
+    asyncio.create_task = create_task
+
+    device = XDevice(deviceid="1000123abc")
+    loop = asyncio.get_event_loop()
+    # noinspection PyTypeChecker
+    registry: XRegistry = XRegistry(None)
+    registry._send = send
+
+    loop.create_task(registry.send(device, {"switch": "on"}))
+    loop.create_task(registry.send(device, {"sledOnline": "off"}))
+    loop.run_until_complete(asyncio.sleep(.1))
+    assert len(registry_send) == 1
+    assert registry_send[0][1] == {"switch": "on", "sledOnline": "off"}
+
+    # same param with different value and commands can't be merged, but they
+    # can't overtake pending update
+    registry_send.clear()
+    loop.create_task(registry.send(device, {"switch": "on"}))
+    loop.create_task(registry.send(device, {"switch": "off"}))
+    loop.create_task(registry.send(device, {"cmd": "transmit", "rfChl": 1}))
+    loop.run_until_complete(asyncio.sleep(.1))
+    assert [i[1] for i in registry_send] == [
+        {"switch": "on"}, {"switch": "off"}, {"cmd": "transmit", "rfChl": 1}
+    ]
+
+    # cancelled first sender won't cancel other senders
+    registry_send.clear()
+    task1 = loop.create_task(registry.send(device, {"switch": "on"}))
+    task2 = loop.create_task(registry.send(device, {"sledOnline": "on"}))
+    loop.run_until_complete(asyncio.sleep(0))
+    task1.cancel()
+    loop.run_until_complete(asyncio.sleep(.1))
+    assert task1.cancelled()
+    assert task2.done() and not task2.cancelled()
+    assert registry_send[0][1] == {"switch": "on", "sledOnline": "on"}
+    assert registry._pending == {}
+
+    # send error returned to the caller without unretrieved errors
+    async def send_error(*args):
+        raise ValueError
+
+    errors = []
+    loop.set_exception_handler(lambda _, context: errors.append(context))
+    registry._send = send_error
+    task = loop.create_task(registry.send(device, {"switch": "on"}))
+    loop.run_until_complete(asyncio.sleep(.1))
+    assert isinstance(task.exception(), ValueError)
+    del task
+    loop.set_exception_handler(None)
+    assert errors == []
+
+
+def test_send_both():
+    loop = asyncio.get_event_loop()
+    # noinspection PyTypeChecker
+    registry: XRegistry = XRegistry(None)
+    registry.cloud.auth = {"user": {"apikey": "123"}}
+
+    device = XDevice(deviceid="1000123abc", apikey="123")
+
+    lan = {"delay": 0, "ok": "online"}
+
+    async def local_send(*args):
+        await asyncio.sleep(lan["delay"])
+        return lan["ok"]
+
+    class WebSocket:
+        reply = False
+        sent = []
+
+        async def send_json(self, payload: dict):
+            self.sent.append(payload)
+            if self.reply:
+                loop.call_soon(
+                    registry.cloud._set_response, payload["sequence"], 0
+                )
+
+    registry.local.send = local_send
+    registry.cloud.ws = ws = WebSocket()
+
+    # LAN responds fast, Cloud not used
+    ok = loop.run_until_complete(
+        registry.send_both(device, {"switch": "on"}, None, "1")
+    )
+    assert ok == ("online", False)
+    assert ws.sent == []
+
+    # LAN fails fast, Cloud used without delay
+    lan["ok"] = "E#CON"
+    ws.reply = True
+    ok = loop.run_until_complete(asyncio.wait_for(
+        registry.send_both(device, {"switch": "on"}, None, "2"), .5
+    ))
+    assert ok == ("online", True)
+    assert len(ws.sent) == 1
+
+    # LAN is slow, Cloud wins
+    lan["ok"] = "online"
+    lan["delay"] = 3
+    ok = loop.run_until_complete(
+        registry.send_both(device, {"switch": "on"}, None, "3")
+    )
+    assert ok == ("online", True)
+    assert len(ws.sent) == 2
+    assert registry.cloud._waiters == {}
+
+    # LAN is slow, but wins, Cloud stops waiting response
+    lan["delay"] = 1.2
+    ws.reply = False
+    ok = loop.run_until_complete(
+        registry.send_both(device, {"switch": "on"}, None, "4")
+    )
+    assert ok == ("online", False)
+    assert len(ws.sent) == 3
+    loop.run_until_complete(asyncio.sleep(.01))
+    assert registry.cloud._waiters == {}
+    # late Cloud response won't raise an error
+    assert registry.cloud._set_response("4", 0) is False